@@ -38,6 +38,9 @@ impl Model {
     pub fn disable_code_coverage(&mut self) {
         self.coverage_info.enabled = false;
     }
+    pub fn code_coverage_enabled(&self) -> bool {
+        self.coverage_info.enabled
+    }
     pub fn handle_coverage(&mut self, instance: &mut RpcContractInstance) -> Result<(), Error> {
         if self.coverage_info.enabled {
             let cov = instance.dump_coverage()?;
@@ -7,6 +7,15 @@ use std::collections::BTreeMap;
 pub struct ContractInfo {
     pub code_id: u64,
 }
+
+/// statistics of the response cache kept by a client backend
+#[derive(Clone, Debug, Default, PartialEq, Eq)]
+pub struct CacheStats {
+    pub entries: usize,
+    pub hits: u64,
+    pub misses: u64,
+}
+
 pub trait CwClientBackend: CwClientBackendClone + Send + Sync {
     fn block_number(&self) -> u64;
     fn chain_id(&mut self) -> Result<String, Error>;
@@ -24,6 +33,15 @@ pub trait CwClientBackend: CwClientBackendClone + Send + Sync {
     ) -> Result<BTreeMap<Vec<u8>, Vec<u8>>, Error>;
     fn query_wasm_contract_info(&mut self, address: &str) -> Result<ContractInfo, Error>;
     fn query_wasm_contract_code(&mut self, code_id: u64) -> Result<Vec<u8>, Error>;
+
+    /// backends without a response cache have nothing to clear
+    fn clear_cache(&mut self) -> Result<(), Error> {
+        Ok(())
+    }
+
+    fn cache_stats(&self) -> CacheStats {
+        CacheStats::default()
+    }
 }
 
 pub trait CwClientBackendClone {
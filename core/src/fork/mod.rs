@@ -11,7 +11,7 @@ mod states;
 mod storage;
 
 pub use api::RpcMockApi;
-pub use client_backend::CwClientBackend;
+pub use client_backend::{CacheStats, CwClientBackend};
 pub use debug_log::DebugLog;
 pub use instance::{RpcContractInstance, RpcInstance};
 pub use items::rpc_items;
@@ -1,8 +1,8 @@
 use crate::coverage::CoverageInfo;
 use crate::fork::api::canonical_to_human;
 use crate::{
-    rpc_items, AllStates, ContractState, ContractStorage, CwClientBackend, CwRpcClient, DebugLog,
-    Error, RpcContractInstance, RpcInstance, RpcMockApi, RpcMockQuerier, RpcMockStorage,
+    rpc_items, AllStates, CacheStats, ContractState, ContractStorage, CwClientBackend, CwRpcClient,
+    DebugLog, Error, RpcContractInstance, RpcInstance, RpcMockApi, RpcMockQuerier, RpcMockStorage,
 };
 
 use cosmwasm_std::{
@@ -37,6 +37,8 @@ pub struct Model {
     pub coverage_info: CoverageInfo,
     // for saving webassembly compilation time
     pub wasm_cache: HashMap<Vec<u8>, Module>,
+    // wasm query results since the last state change
+    query_cache: HashMap<(Addr, Vec<u8>), Binary>,
 }
 
 const WASM_MAGIC: [u8; 4] = [0, 97, 115, 109];
@@ -65,6 +67,7 @@ impl Clone for Model {
             custom_codes: self.custom_codes.clone(),
             coverage_info: self.coverage_info.clone(),
             wasm_cache: self.wasm_cache.clone(),
+            query_cache: self.query_cache.clone(),
         }
     }
 }
@@ -80,6 +83,7 @@ impl Model {
             custom_codes: HashMap::new(),
             coverage_info: CoverageInfo::new(),
             wasm_cache: HashMap::new(),
+            query_cache: HashMap::new(),
         })
     }
 
@@ -94,6 +98,7 @@ impl Model {
             custom_codes: HashMap::new(),
             coverage_info: CoverageInfo::new(),
             wasm_cache: HashMap::new(),
+            query_cache: HashMap::new(),
         })
     }
 
@@ -101,6 +106,15 @@ impl Model {
         self.states.read().unwrap().client.block_number()
     }
 
+    /// drop every cached RPC response, including the ones persisted on disk
+    pub fn clear_cache(&mut self) -> Result<(), Error> {
+        self.states.write().unwrap().client.clear_cache()
+    }
+
+    pub fn cache_stats(&self) -> CacheStats {
+        self.states.read().unwrap().client.cache_stats()
+    }
+
     /// Does nothing if the state already exists
     fn fetch_contract_state(&self, contract_addr: &Addr) -> Result<(), Error> {
         if self
@@ -438,19 +452,34 @@ impl Model {
         msg: &[u8],
         funds: &[Coin],
     ) -> Result<DebugLog, Error> {
+        let (debug_log, _) = self.instantiate_with_address(code_id, msg, funds)?;
+        Ok(debug_log)
+    }
+
+    /// same as instantiate, but also returns the address of the new contract
+    /// the address is None if the instantiation failed and was reverted
+    pub fn instantiate_with_address(
+        &mut self,
+        code_id: u64,
+        msg: &[u8],
+        funds: &[Coin],
+    ) -> Result<(DebugLog, Option<Addr>), Error> {
+        self.query_cache.clear();
         let sender = self.sender.clone();
         let empty_log = DebugLog::new();
         let state_copy = self.clone();
 
-        let (res, _) = self.instantiate_inner(code_id, &Addr::unchecked(sender), msg, funds)?;
+        let (res, new_addr) =
+            self.instantiate_inner(code_id, &Addr::unchecked(sender), msg, funds)?;
         if res.is_err() {
             let orig_state = self.revert(state_copy);
             let debug_log: DebugLog =
                 mem::replace(&mut orig_state.debug_log.lock().unwrap(), empty_log);
-            Ok(debug_log)
+            Ok((debug_log, None))
         } else {
             self.states.write().unwrap().update_block();
-            Ok(mem::replace(&mut self.debug_log.lock().unwrap(), empty_log))
+            let debug_log = mem::replace(&mut self.debug_log.lock().unwrap(), empty_log);
+            Ok((debug_log, new_addr))
         }
     }
 
@@ -563,6 +592,7 @@ impl Model {
         msg: &[u8],
         funds: &[Coin],
     ) -> Result<DebugLog, Error> {
+        self.query_cache.clear();
         let empty_log = DebugLog::new();
         let sender = self.sender.clone();
         let state_copy = self.clone();
@@ -642,8 +672,41 @@ impl Model {
         Ok(response)
     }
 
+    /// run several executions in order, each one is committed or reverted on its own like `execute`
+    /// a simulator error aborts the batch, executions before it stay applied
+    pub fn execute_batch(
+        &mut self,
+        calls: &[(Addr, &[u8], Vec<Coin>)],
+    ) -> Result<Vec<DebugLog>, Error> {
+        let mut out = Vec::with_capacity(calls.len());
+        for (contract_addr, msg, funds) in calls {
+            out.push(self.execute(contract_addr, msg, funds)?);
+        }
+        Ok(out)
+    }
+
+    /// run several wasm queries in order, the first error aborts the batch
+    pub fn query_batch(&mut self, queries: &[(Addr, &[u8])]) -> Result<Vec<Binary>, Error> {
+        let mut out = Vec::with_capacity(queries.len());
+        for (contract_addr, msg) in queries {
+            out.push(self.wasm_query(contract_addr, msg)?);
+        }
+        Ok(out)
+    }
+
     /// for now, only support WASM queries
+    /// results are cached until the next state change, unless code coverage is enabled
     pub fn wasm_query(&mut self, contract_addr: &Addr, msg: &[u8]) -> Result<Binary, Error> {
+        // coverage is only collected when the contract actually runs
+        let cache_key = if self.code_coverage_enabled() {
+            None
+        } else {
+            let key = (contract_addr.clone(), msg.to_vec());
+            if let Some(result) = self.query_cache.get(&key) {
+                return Ok(result.clone());
+            }
+            Some(key)
+        };
         let env = self.env(contract_addr)?;
         let mut instance = self.create_instance(contract_addr)?;
         let wasm_query = WasmQuery::Smart {
@@ -653,7 +716,11 @@ impl Model {
         // TODO: fix this, propagate contract error down
         let result = instance.query(&env, &wasm_query);
         self.handle_coverage(&mut instance)?;
-        Ok(result?)
+        let result = result?;
+        if let Some(key) = cache_key {
+            self.query_cache.insert(key, result.clone());
+        }
+        Ok(result)
     }
 
     pub fn bank_query(&mut self, bank_query_: &[u8]) -> Result<Binary, Error> {
@@ -707,12 +774,14 @@ impl Model {
 
     /// modify block number
     pub fn cheat_block_number(&mut self, new_number: u64) -> Result<(), Error> {
+        self.query_cache.clear();
         self.states.write().unwrap().block_number = new_number;
         Ok(())
     }
 
     /// modify block timestamp
     pub fn cheat_block_timestamp(&mut self, new_timestamp: Timestamp) -> Result<(), Error> {
+        self.query_cache.clear();
         self.states.write().unwrap().block_timestamp = new_timestamp;
         Ok(())
     }
@@ -724,6 +793,7 @@ impl Model {
         denom: &str,
         new_balance: u128,
     ) -> Result<(), Error> {
+        self.query_cache.clear();
         self.states
             .write()
             .unwrap()
@@ -733,6 +803,7 @@ impl Model {
 
     /// modify code
     pub fn cheat_code(&mut self, contract_addr: &Addr, new_code: &[u8]) -> Result<(), Error> {
+        self.query_cache.clear();
         self.fetch_contract_state(contract_addr)?;
 
         let old_contract_state = self
@@ -772,6 +843,7 @@ impl Model {
         key: &[u8],
         value: &[u8],
     ) -> Result<(), Error> {
+        self.query_cache.clear();
         self.fetch_contract_state(contract_addr)?;
         let mut states = self.states.write().unwrap();
         let contract_storage = states.contract_state_get_mut(contract_addr).unwrap();
@@ -963,6 +1035,105 @@ mod test {
         assert_eq!(query_res1.value, query_res2.value);
     }
 
+    #[test]
+    fn test_query_cache() {
+        use test_contract::msg::{InstantiateMsg, QueryMsg, ReadNumberResponse};
+        let mut model = Model::new(MALAGA_RPC_URL, Some(MALAGA_BLOCK_NUMBER), "wasm").unwrap();
+        let code = include_bytes!(concat!(
+            env!("OUT_DIR"),
+            "/wasm32-unknown-unknown/release/test_contract.wasm"
+        ));
+        model.add_custom_code(1337, code).unwrap();
+        let msg = to_binary(&InstantiateMsg {}).unwrap();
+        let (_, contract_address) = model
+            .instantiate_with_address(1337, msg.as_slice(), &[])
+            .unwrap();
+        let contract_address = contract_address.unwrap();
+
+        // repeated queries are answered from the cache
+        let msg = to_binary(&QueryMsg::ReadNumber {}).unwrap();
+        let query_res1 = model.wasm_query(&contract_address, msg.as_slice()).unwrap();
+        let query_res2 = model.wasm_query(&contract_address, msg.as_slice()).unwrap();
+        assert_eq!(query_res1, query_res2);
+        assert_eq!(model.query_cache.len(), 1);
+
+        // overwrite NUMBER, the cached result must not be returned anymore
+        model
+            .cheat_storage(&contract_address, b"number", b"7")
+            .unwrap();
+        assert!(model.query_cache.is_empty());
+        let query_res3: ReadNumberResponse =
+            from_binary(&model.wasm_query(&contract_address, msg.as_slice()).unwrap()).unwrap();
+        assert_eq!(query_res3.value, 7);
+
+        // queries always run while coverage is collected
+        model.enable_code_coverage();
+        let _ = model.wasm_query(&contract_address, msg.as_slice()).unwrap();
+        assert_eq!(model.query_cache.len(), 1);
+    }
+
+    #[test]
+    fn test_batch() {
+        use test_contract::msg::{ExecuteMsg, InstantiateMsg, QueryMsg, ReadNumberResponse};
+        let mut model = Model::new(MALAGA_RPC_URL, Some(MALAGA_BLOCK_NUMBER), "wasm").unwrap();
+        let code = include_bytes!(concat!(
+            env!("OUT_DIR"),
+            "/wasm32-unknown-unknown/release/test_contract.wasm"
+        ));
+        model.add_custom_code(1337, code).unwrap();
+        let msg = to_binary(&InstantiateMsg {}).unwrap();
+        let (_, addr_a) = model
+            .instantiate_with_address(1337, msg.as_slice(), &[])
+            .unwrap();
+        let (_, addr_b) = model
+            .instantiate_with_address(1337, msg.as_slice(), &[])
+            .unwrap();
+        let (addr_a, addr_b) = (addr_a.unwrap(), addr_b.unwrap());
+        model.cheat_storage(&addr_a, b"number", b"7").unwrap();
+        model.cheat_storage(&addr_b, b"number", b"9").unwrap();
+
+        let atomic_msg = to_binary(&ExecuteMsg::TestAtomic {}).unwrap();
+        let query_self_msg = to_binary(&ExecuteMsg::TestQuerySelf {}).unwrap();
+        let read_msg = to_binary(&QueryMsg::ReadNumber {}).unwrap();
+        let read_numbers = |model: &mut Model| -> Vec<u32> {
+            model
+                .query_batch(&[
+                    (addr_a.clone(), read_msg.as_slice()),
+                    (addr_b.clone(), read_msg.as_slice()),
+                ])
+                .unwrap()
+                .iter()
+                .map(|r| from_binary::<ReadNumberResponse>(r).unwrap().value)
+                .collect()
+        };
+
+        // logs come back in order, the failing call is reverted without affecting the other one
+        let debug_logs = model
+            .execute_batch(&[
+                (addr_a.clone(), atomic_msg.as_slice(), vec![]),
+                (addr_b.clone(), query_self_msg.as_slice(), vec![]),
+            ])
+            .unwrap();
+        assert_eq!(debug_logs.len(), 2);
+        assert!(debug_logs[0].err_msg.is_some());
+        assert_eq!(debug_logs[1].err_msg, None);
+        assert_eq!(read_numbers(&mut model), vec![7, 1]);
+
+        // a simulator error aborts the batch, calls before it stay applied
+        model.cheat_storage(&addr_b, b"number", b"9").unwrap();
+        let res = model.execute_batch(&[
+            (addr_a.clone(), query_self_msg.as_slice(), vec![]),
+            (
+                Addr::unchecked("wasm1nonexistent"),
+                query_self_msg.as_slice(),
+                vec![],
+            ),
+            (addr_b.clone(), query_self_msg.as_slice(), vec![]),
+        ]);
+        assert!(res.is_err());
+        assert_eq!(read_numbers(&mut model), vec![1, 9]);
+    }
+
     #[test]
     fn test_query() {
         let mut model = Model::new(MALAGA_RPC_URL, Some(MALAGA_BLOCK_NUMBER), "wasm").unwrap();
@@ -1022,6 +1193,25 @@ mod test {
         assert_eq!(query_res.value, 1);
     }
 
+    #[test]
+    fn test_instantiate_with_address() {
+        use test_contract::msg::InstantiateMsg;
+        let mut model = Model::new(MALAGA_RPC_URL, Some(MALAGA_BLOCK_NUMBER), "wasm").unwrap();
+        let code = include_bytes!(concat!(
+            env!("OUT_DIR"),
+            "/wasm32-unknown-unknown/release/test_contract.wasm"
+        ));
+        model.add_custom_code(1337, code).unwrap();
+        let msg = to_binary(&InstantiateMsg {}).unwrap();
+        let (debug_log, contract_address) = model
+            .instantiate_with_address(1337, msg.as_slice(), &[])
+            .unwrap();
+        assert_eq!(
+            contract_address.unwrap().to_string(),
+            get_contract_address_from_log(&debug_log.logs).unwrap()
+        );
+    }
+
     #[test]
     fn test_call_trace() {
         let mut model = Model::new(MALAGA_RPC_URL, Some(MALAGA_BLOCK_NUMBER), "wasm").unwrap();
@@ -17,13 +17,15 @@ use std::hash::Hash;
 use std::io::{Read, Seek, SeekFrom, Write};
 use std::path::Path;
 use std::str::FromStr;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Arc;
 use tendermint::abci;
 use tendermint::block::Height;
 use tendermint::Time;
 use tendermint_rpc::{Client, HttpClient};
 use tokio;
 
-use super::client_backend::ContractInfo;
+use super::client_backend::{CacheStats, ContractInfo};
 use crate::CwClientBackend;
 use crate::Error;
 
@@ -50,6 +52,9 @@ pub struct CwRpcClient {
     block_number: u64,
 
     cache: RpcCache,
+    // shared between clones, so that reverted transactions are still accounted for
+    cache_hits: Arc<AtomicU64>,
+    cache_misses: Arc<AtomicU64>,
 }
 
 #[derive(Deserialize, Serialize, PartialEq, Eq, Hash, Clone)]
@@ -69,6 +74,10 @@ pub struct RpcCacheInner {
 
 pub enum RpcCache {
     Empty,
+    // used when simulating on top of the latest block, which is never persisted to disk
+    Memory {
+        inner: RpcCacheInner,
+    },
     FileBacked {
         // (path: String, data: Vec<u8>) -> AbciQuery.value
         inner: RpcCacheInner,
@@ -82,6 +91,9 @@ impl Clone for RpcCache {
     fn clone(&self) -> Self {
         match self {
             Self::Empty => Self::Empty,
+            Self::Memory { inner } => Self::Memory {
+                inner: inner.clone(),
+            },
             Self::FileBacked {
                 inner, file_name, ..
             } => Self::FileBacked {
@@ -137,20 +149,22 @@ impl RpcCache {
         match self {
             // empty always returns None
             Self::Empty => Ok(None),
-            Self::FileBacked { inner, .. } => Ok(inner.db.get(&key).cloned()),
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => {
+                Ok(inner.db.get(&key).cloned())
+            }
         }
     }
 
     fn chain_id(&self) -> Option<String> {
         match self {
-            Self::FileBacked { inner, .. } => Some(inner.chain_id.clone()),
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => Some(inner.chain_id.clone()),
             Self::Empty => None,
         }
     }
 
     fn timestamp(&self) -> Option<u64> {
         match self {
-            Self::FileBacked { inner, .. } => Some(inner.timestamp),
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => Some(inner.timestamp),
             Self::Empty => None,
         }
     }
@@ -163,7 +177,7 @@ impl RpcCache {
         match self {
             // empty always returns None
             Self::Empty => Ok(()),
-            Self::FileBacked { inner, .. } => {
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => {
                 inner.db.insert(key, response.to_owned());
                 Ok(())
             }
@@ -172,7 +186,7 @@ impl RpcCache {
 
     fn save(&mut self) -> Result<(), Error> {
         match self {
-            Self::Empty => Ok(()),
+            Self::Empty | Self::Memory { .. } => Ok(()),
             Self::FileBacked { inner, file, .. } => {
                 let serialized = bincode::serialize(inner).map_err(Error::format_error)?;
                 file.seek(SeekFrom::Start(0)).map_err(Error::io_error)?;
@@ -182,23 +196,47 @@ impl RpcCache {
         }
     }
 
+    /// drops all cached responses, chain_id and timestamp are kept since they never change for a block
+    fn clear(&mut self) -> Result<(), Error> {
+        match self {
+            Self::Empty => Ok(()),
+            Self::Memory { inner } => {
+                inner.db.clear();
+                Ok(())
+            }
+            Self::FileBacked { inner, file, .. } => {
+                inner.db.clear();
+                file.set_len(0).map_err(Error::io_error)?;
+                self.save()
+            }
+        }
+    }
+
+    fn len(&self) -> usize {
+        match self {
+            Self::Empty => 0,
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => inner.db.len(),
+        }
+    }
+
     fn initialized(&self) -> bool {
         match self {
             Self::Empty => true,
+            Self::Memory { .. } => false,
             Self::FileBacked { initialized, .. } => *initialized,
         }
     }
 
     fn set_chain_id(&mut self, chain_id: String) {
         match self {
-            Self::FileBacked { inner, .. } => inner.chain_id = chain_id,
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => inner.chain_id = chain_id,
             Self::Empty => {}
         }
     }
 
     fn set_timestamp(&mut self, timestamp: u64) {
         match self {
-            Self::FileBacked { inner, .. } => inner.timestamp = timestamp,
+            Self::FileBacked { inner, .. } | Self::Memory { inner } => inner.timestamp = timestamp,
             Self::Empty => {}
         }
     }
@@ -221,8 +259,11 @@ impl CwRpcClient {
             },
             block_number: 0,
             cache: RpcCache::Empty,
+            cache_hits: Arc::new(AtomicU64::new(0)),
+            cache_misses: Arc::new(AtomicU64::new(0)),
         };
         if let Some(bn) = block_number {
+            rv.block_number = bn;
             // first check if cache exists
             rv.cache = RpcCache::file_backed(url, bn)?;
             if !rv.cache.initialized() {
@@ -238,7 +279,10 @@ impl CwRpcClient {
             rv.block_number = block_height;
             // Don't change this line's order. To fetch the timestamp block_number must be properly initialized
             let timestamp = rv.timestamp()?;
-            rv.cache = RpcCache::file_backed(url, block_height)?;
+            // the latest block is a moving target, so keep its responses in memory only
+            rv.cache = RpcCache::Memory {
+                inner: RpcCacheInner::default(),
+            };
             rv.cache.set_chain_id(chain_id);
             rv.cache.set_timestamp(timestamp.nanos());
             Ok(rv)
@@ -247,8 +291,10 @@ impl CwRpcClient {
 
     pub fn abci_query_raw(&mut self, path_: &str, data: &[u8]) -> Result<Vec<u8>, Error> {
         if let Some(in_db) = self.cache.read(path_, data)? {
+            self.cache_hits.fetch_add(1, Ordering::Relaxed);
             return Ok(in_db);
         }
+        self.cache_misses.fetch_add(1, Ordering::Relaxed);
         let path = match abci::Path::from_str(path_) {
             Ok(p) => p,
             Err(e) => {
@@ -301,6 +347,20 @@ impl CwClientBackend for CwRpcClient {
         self.block_number
     }
 
+    fn clear_cache(&mut self) -> Result<(), Error> {
+        self.cache_hits.store(0, Ordering::Relaxed);
+        self.cache_misses.store(0, Ordering::Relaxed);
+        self.cache.clear()
+    }
+
+    fn cache_stats(&self) -> CacheStats {
+        CacheStats {
+            entries: self.cache.len(),
+            hits: self.cache_hits.load(Ordering::Relaxed),
+            misses: self.cache_misses.load(Ordering::Relaxed),
+        }
+    }
+
     fn chain_id(&mut self) -> Result<String, Error> {
         if let Some(chain_id) = self.cache.chain_id() {
             Ok(chain_id)
@@ -602,4 +662,26 @@ mod tests {
         let data = cache.read(path, data).unwrap();
         println!("{:?}", &data);
     }
+
+    #[test]
+    fn test_pinned_block_number() {
+        let client = CwRpcClient::new(MALAGA_RPC_URL, Some(MALAGA_BLOCK_NUMBER)).unwrap();
+        assert_eq!(client.block_number(), MALAGA_BLOCK_NUMBER);
+    }
+
+    #[test]
+    fn test_cache_clear() {
+        let mut cache = RpcCache::file_backed(MALAGA_RPC_URL, 100001).unwrap();
+        let path = "aaaaaaaa";
+        let data = "bbbbbbbb".as_bytes();
+        let response = "cccccccc".as_bytes();
+        cache.write(path, data, response).unwrap();
+        assert_eq!(cache.len(), 1);
+        cache.clear().unwrap();
+        assert_eq!(cache.len(), 0);
+        drop(cache);
+
+        let cache = RpcCache::file_backed(MALAGA_RPC_URL, 100001).unwrap();
+        assert_eq!(cache.read(path, data).unwrap(), None);
+    }
 }
@@ -1,12 +1,72 @@
 use std::collections::HashMap;
+use std::sync::Mutex;
 
-use cosmwasm_simulate::{Addr, Coin, Timestamp, Uint128};
+use cosmwasm_simulate::{Addr, Coin, Error, Timestamp, Uint128};
 // we don't import Model and DebugLog in order to use their names for Python classes
-use pyo3::{exceptions::PyRuntimeError, prelude::*};
+use pyo3::{buffer::PyBuffer, exceptions::PyRuntimeError, prelude::*, types::PyBytes};
 
+fn to_coins(funds: &[(String, u128)]) -> Vec<Coin> {
+    funds
+        .iter()
+        .map(|(d, a)| Coin {
+            denom: d.to_string(),
+            amount: Uint128::new(*a),
+        })
+        .collect()
+}
+
+/// converts a JSON scalar to the matching Python object
+fn json_scalar_to_py(py: Python, value: &serde_json::Value) -> PyResult<PyObject> {
+    match value {
+        serde_json::Value::Null => Ok(py.None()),
+        serde_json::Value::Bool(b) => Ok(b.into_py(py)),
+        serde_json::Value::Number(n) => {
+            if let Some(n) = n.as_u64() {
+                Ok(n.into_py(py))
+            } else if let Some(n) = n.as_i64() {
+                Ok(n.into_py(py))
+            } else {
+                Ok(n.as_f64().unwrap_or(f64::NAN).into_py(py))
+            }
+        }
+        serde_json::Value::String(s) => Ok(s.into_py(py)),
+        _ => Err(PyRuntimeError::new_err("query result is not a scalar")),
+    }
+}
+
+/// addresses are accepted both as str and as utf-8 encoded bytes
+fn extract_addr(addr: &PyAny) -> PyResult<Addr> {
+    // check the type first, a failed extract builds an error that would just be thrown away
+    if let Ok(addr) = addr.downcast::<PyBytes>() {
+        let addr = std::str::from_utf8(addr.as_bytes())
+            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
+        return Ok(Addr::unchecked(addr));
+    }
+    Ok(Addr::unchecked(addr.extract::<&str>()?))
+}
+
+/// The simulator state sits behind a mutex and every method releases the GIL while it runs.
+/// Other Python threads keep running during long simulations, and calls made on the same
+/// Model from several threads are serialized on the mutex instead of failing to borrow it.
 #[pyclass]
 struct Model {
-    inner: cosmwasm_simulate::Model,
+    inner: Mutex<cosmwasm_simulate::Model>,
+}
+
+impl Model {
+    /// runs `f` on the inner model with the GIL released
+    fn with_model<T, F>(&self, py: Python, f: F) -> PyResult<T>
+    where
+        T: Send,
+        F: Send + FnOnce(&mut cosmwasm_simulate::Model) -> Result<T, Error>,
+    {
+        py.allow_threads(|| {
+            // a panic inside the simulator poisons the lock, keep the model usable like before
+            let mut model = self.inner.lock().unwrap_or_else(|e| e.into_inner());
+            f(&mut model)
+        })
+        .map_err(|e| PyRuntimeError::new_err(e.to_string()))
+    }
 }
 
 #[pyclass]
@@ -50,170 +110,253 @@ impl DebugLog {
 #[pymethods]
 impl Model {
     #[new]
-    fn new(url: String, block_number: Option<u64>, bech32_prefix: String) -> PyResult<Model> {
-        let model = cosmwasm_simulate::Model::new(&url, block_number, &bech32_prefix)
+    /// the initial RPC sync runs with the GIL released, like every other method
+    fn new(
+        py: Python,
+        url: String,
+        block_number: Option<u64>,
+        bech32_prefix: String,
+    ) -> PyResult<Model> {
+        let model = py
+            .allow_threads(|| cosmwasm_simulate::Model::new(&url, block_number, &bech32_prefix))
             .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(Model { inner: model })
+        Ok(Model {
+            inner: Mutex::new(model),
+        })
     }
 
-    pub fn block_number(mut self_: PyRefMut<Self>) -> PyResult<u64> {
-        let model = &mut self_.inner;
-        Ok(model.block_number())
+    pub fn block_number(self_: PyRef<Self>) -> PyResult<u64> {
+        self_.with_model(self_.py(), |model| Ok(model.block_number()))
     }
 
-    pub fn add_custom_code(mut self_: PyRefMut<Self>, code_id: u64, code: &[u8]) -> PyResult<()> {
-        let model = &mut self_.inner;
-        model
-            .add_custom_code(code_id, code)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+    /// drop every cached RPC response, including the ones persisted on disk
+    pub fn clear_cache(self_: PyRef<Self>) -> PyResult<()> {
+        self_.with_model(self_.py(), |model| model.clear_cache())
+    }
+
+    pub fn cache_stats(self_: PyRef<Self>) -> PyResult<HashMap<String, u64>> {
+        let stats = self_.with_model(self_.py(), |model| Ok(model.cache_stats()))?;
+        let mut out = HashMap::new();
+        out.insert("entries".to_string(), stats.entries as u64);
+        out.insert("hits".to_string(), stats.hits);
+        out.insert("misses".to_string(), stats.misses);
+        Ok(out)
+    }
+
+    pub fn add_custom_code(self_: PyRef<Self>, code_id: u64, code_: PyBuffer<u8>) -> PyResult<()> {
+        let py = self_.py();
+        // copied while the GIL is held, no other thread can write to it while the simulator reads
+        let code = code_.to_vec(py)?;
+        self_.with_model(py, |model| model.add_custom_code(code_id, &code))
     }
 
     pub fn instantiate(
-        mut self_: PyRefMut<Self>,
+        self_: PyRef<Self>,
         code_id: u64,
         msg: &[u8],
         funds_: Vec<(String, u128)>,
     ) -> PyResult<DebugLog> {
-        let model = &mut self_.inner;
-        let funds: Vec<Coin> = funds_
-            .iter()
-            .map(|(d, a)| Coin {
-                denom: d.to_string(),
-                amount: Uint128::new(*a),
-            })
-            .collect();
-        let debug_log = model
-            .instantiate(code_id, msg, &funds)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
+        let funds = to_coins(&funds_);
+        let debug_log =
+            self_.with_model(self_.py(), |model| model.instantiate(code_id, msg, &funds))?;
         Ok(DebugLog { inner: debug_log })
     }
 
+    /// same as instantiate, but also returns the address of the new contract (None on failure)
+    pub fn instantiate_ret_addr(
+        self_: PyRef<Self>,
+        code_id: u64,
+        msg: &[u8],
+        funds_: Vec<(String, u128)>,
+    ) -> PyResult<(Option<String>, DebugLog)> {
+        let funds = to_coins(&funds_);
+        let (debug_log, contract_addr) = self_.with_model(self_.py(), |model| {
+            model.instantiate_with_address(code_id, msg, &funds)
+        })?;
+        Ok((
+            contract_addr.map(|a| a.to_string()),
+            DebugLog { inner: debug_log },
+        ))
+    }
+
     pub fn execute(
-        mut self_: PyRefMut<Self>,
-        contract_addr_: &str,
+        self_: PyRef<Self>,
+        contract_addr_: &PyAny,
         msg: &[u8],
         funds_: Vec<(String, u128)>,
     ) -> PyResult<DebugLog> {
-        let model = &mut self_.inner;
-        let funds: Vec<Coin> = funds_
-            .iter()
-            .map(|(d, a)| Coin {
-                denom: d.to_string(),
-                amount: Uint128::new(*a),
-            })
-            .collect();
-        let contract_addr = Addr::unchecked(contract_addr_);
-        let debug_log = model
-            .execute(&contract_addr, msg, &funds)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
+        let funds = to_coins(&funds_);
+        let contract_addr = extract_addr(contract_addr_)?;
+        let debug_log = self_.with_model(self_.py(), |model| {
+            model.execute(&contract_addr, msg, &funds)
+        })?;
         Ok(DebugLog { inner: debug_log })
     }
 
+    /// the response is returned as bytes, ready to be passed to json.loads
     pub fn wasm_query(
-        mut self_: PyRefMut<Self>,
-        contract_addr_: &str,
+        self_: PyRef<Self>,
+        contract_addr_: &PyAny,
         msg: &[u8],
-    ) -> PyResult<Vec<u8>> {
-        let model = &mut self_.inner;
-        let contract_addr = Addr::unchecked(contract_addr_);
-        let out = model
-            .wasm_query(&contract_addr, msg)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(out.to_vec())
+    ) -> PyResult<Py<PyBytes>> {
+        let py = self_.py();
+        let contract_addr = extract_addr(contract_addr_)?;
+        let result = self_.with_model(py, |model| model.wasm_query(&contract_addr, msg))?;
+        Ok(PyBytes::new(py, result.as_slice()).into())
     }
 
-    pub fn bank_query(mut self_: PyRefMut<Self>, msg: &[u8]) -> PyResult<Vec<u8>> {
-        let model = &mut self_.inner;
-        let out = model
-            .bank_query(msg)
+    /// query a contract and return only the scalar found at `path`, a JSON pointer like "/balance"
+    /// numbers are returned as int or float, strings (including Uint128 amounts) as str
+    pub fn wasm_query_typed(
+        self_: PyRef<Self>,
+        contract_addr_: &PyAny,
+        msg: &[u8],
+        path: &str,
+    ) -> PyResult<PyObject> {
+        let py = self_.py();
+        let contract_addr = extract_addr(contract_addr_)?;
+        let result = self_.with_model(py, |model| model.wasm_query(&contract_addr, msg))?;
+        let value: serde_json::Value = serde_json::from_slice(result.as_slice())
             .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(out.to_vec())
+        let scalar = value.pointer(path).ok_or_else(|| {
+            PyRuntimeError::new_err(format!("{} not found in query result", path))
+        })?;
+        json_scalar_to_py(py, scalar)
     }
 
-    pub fn cheat_block_number(mut self_: PyRefMut<Self>, block_number: u64) -> PyResult<()> {
-        let model = &mut self_.inner;
-        model
-            .cheat_block_number(block_number)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+    /// run several executions in one call, returning the debug log of each one in order
+    /// an execution that fails inside the contract is reverted on its own and does not stop the
+    /// remaining ones, its error is reported in its debug log. a simulator error (RPC failure,
+    /// invalid wasm, ...) aborts the whole batch with an exception, executions before it stay
+    /// applied and their debug logs are lost
+    pub fn execute_batch(
+        self_: PyRef<Self>,
+        calls: Vec<(&PyAny, &[u8], Vec<(String, u128)>)>,
+    ) -> PyResult<Vec<DebugLog>> {
+        let calls = calls
+            .into_iter()
+            .map(|(contract_addr_, msg, funds_)| {
+                Ok((extract_addr(contract_addr_)?, msg, to_coins(&funds_)))
+            })
+            .collect::<PyResult<Vec<_>>>()?;
+        let debug_logs = self_.with_model(self_.py(), |model| model.execute_batch(&calls))?;
+        Ok(debug_logs
+            .into_iter()
+            .map(|debug_log| DebugLog { inner: debug_log })
+            .collect())
+    }
+
+    /// run several wasm queries in one call, returning the responses in order
+    pub fn query_batch(
+        self_: PyRef<Self>,
+        queries: Vec<(&PyAny, &[u8])>,
+    ) -> PyResult<Vec<Py<PyBytes>>> {
+        let py = self_.py();
+        let queries = queries
+            .into_iter()
+            .map(|(contract_addr_, msg)| Ok((extract_addr(contract_addr_)?, msg)))
+            .collect::<PyResult<Vec<_>>>()?;
+        let results = self_.with_model(py, |model| model.query_batch(&queries))?;
+        Ok(results
+            .iter()
+            .map(|result| PyBytes::new(py, result.as_slice()).into())
+            .collect())
+    }
+
+    pub fn bank_query(self_: PyRef<Self>, msg: &[u8]) -> PyResult<Py<PyBytes>> {
+        let py = self_.py();
+        let result = self_.with_model(py, |model| model.bank_query(msg))?;
+        Ok(PyBytes::new(py, result.as_slice()).into())
+    }
+
+    pub fn cheat_block_number(self_: PyRef<Self>, block_number: u64) -> PyResult<()> {
+        self_.with_model(self_.py(), |model| model.cheat_block_number(block_number))
     }
 
     /// set latest block timestamp, units in nanoseconds
-    pub fn cheat_block_timestamp(mut self_: PyRefMut<Self>, timestamp_: u64) -> PyResult<()> {
-        let model = &mut self_.inner;
+    pub fn cheat_block_timestamp(self_: PyRef<Self>, timestamp_: u64) -> PyResult<()> {
         let timestamp = Timestamp::from_nanos(timestamp_);
-        model
-            .cheat_block_timestamp(timestamp)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+        self_.with_model(self_.py(), |model| model.cheat_block_timestamp(timestamp))
     }
 
     pub fn cheat_bank_balance(
-        mut self_: PyRefMut<Self>,
-        addr_: &str,
+        self_: PyRef<Self>,
+        addr_: &PyAny,
         amount: (String, u128),
     ) -> PyResult<()> {
-        let model = &mut self_.inner;
-        let addr = Addr::unchecked(addr_);
+        let addr = extract_addr(addr_)?;
         let (denom, new_balance) = amount;
-        model
-            .cheat_bank_balance(&addr, &denom, new_balance)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+        self_.with_model(self_.py(), |model| {
+            model.cheat_bank_balance(&addr, &denom, new_balance)
+        })
     }
 
     pub fn cheat_code(
-        mut self_: PyRefMut<Self>,
-        contract_addr_: &str,
-        code: &[u8],
+        self_: PyRef<Self>,
+        contract_addr_: &PyAny,
+        code_: PyBuffer<u8>,
     ) -> PyResult<()> {
-        let model = &mut self_.inner;
-        let contract_addr = Addr::unchecked(contract_addr_);
-        model
-            .cheat_code(&contract_addr, code)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+        let py = self_.py();
+        let code = code_.to_vec(py)?;
+        let contract_addr = extract_addr(contract_addr_)?;
+        self_.with_model(py, |model| model.cheat_code(&contract_addr, &code))
     }
 
-    pub fn cheat_message_sender(mut self_: PyRefMut<Self>, sender: &str) -> PyResult<()> {
-        let model = &mut self_.inner;
-        let sender_addr = Addr::unchecked(sender);
-        model
-            .cheat_message_sender(&sender_addr)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+    /// same as cheat_code, but the wasm file is read on the Rust side with the GIL released
+    pub fn cheat_code_from_path(
+        self_: PyRef<Self>,
+        contract_addr_: &PyAny,
+        path: &str,
+    ) -> PyResult<()> {
+        let py = self_.py();
+        let contract_addr = extract_addr(contract_addr_)?;
+        let code = py
+            .allow_threads(|| std::fs::read(path))
+            .map_err(|e| PyRuntimeError::new_err(format!("{}: {}", path, e)))?;
+        self_.with_model(py, |model| model.cheat_code(&contract_addr, &code))
+    }
+
+    pub fn cheat_message_sender(self_: PyRef<Self>, sender: &PyAny) -> PyResult<()> {
+        let sender_addr = extract_addr(sender)?;
+        self_.with_model(self_.py(), |model| model.cheat_message_sender(&sender_addr))
     }
 
     pub fn cheat_storage(
-        mut self_: PyRefMut<Self>,
-        contract_addr: &str,
+        self_: PyRef<Self>,
+        contract_addr: &PyAny,
         key: &[u8],
         value: &[u8],
     ) -> PyResult<()> {
-        let model = &mut self_.inner;
-        let contract_addr = Addr::unchecked(contract_addr);
-        model
-            .cheat_storage(&contract_addr, key, value)
-            .map_err(|e| PyRuntimeError::new_err(e.to_string()))?;
-        Ok(())
+        let contract_addr = extract_addr(contract_addr)?;
+        self_.with_model(self_.py(), |model| {
+            model.cheat_storage(&contract_addr, key, value)
+        })
     }
 
-    pub fn enable_code_coverage(mut self_: PyRefMut<Self>) -> PyResult<()> {
-        let model = &mut self_.inner;
-        model.enable_code_coverage();
-        Ok(())
+    pub fn enable_code_coverage(self_: PyRef<Self>) -> PyResult<()> {
+        self_.with_model(self_.py(), |model| {
+            model.enable_code_coverage();
+            Ok(())
+        })
     }
 
-    pub fn disable_code_coverage(mut self_: PyRefMut<Self>) -> PyResult<()> {
-        let model = &mut self_.inner;
-        model.disable_code_coverage();
-        Ok(())
+    pub fn disable_code_coverage(self_: PyRef<Self>) -> PyResult<()> {
+        self_.with_model(self_.py(), |model| {
+            model.disable_code_coverage();
+            Ok(())
+        })
     }
 
-    pub fn get_code_coverage(mut self_: PyRefMut<Self>) -> PyResult<HashMap<String, Vec<Vec<u8>>>> {
-        let model = &mut self_.inner;
-        Ok(model.get_coverage())
+    pub fn get_code_coverage(self_: PyRef<Self>) -> PyResult<HashMap<String, Vec<Py<PyBytes>>>> {
+        let py = self_.py();
+        let coverage = self_.with_model(py, |model| Ok(model.get_coverage()))?;
+        Ok(coverage
+            .into_iter()
+            .map(|(k, covs)| {
+                let covs = covs.iter().map(|c| PyBytes::new(py, c).into()).collect();
+                (k, covs)
+            })
+            .collect())
     }
 }
 
@@ -1,10 +1,19 @@
 from cwsimpy import Model
-import json
 import sys
 import os
 import base64
 import itertools
-from graphviz import Digraph
+import subprocess
+
+try:
+    from orjson import dumps, loads
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
+    loads = json.loads
 
 TERRASWAP_FACTORY_ADDR = (
     "terra1466nf3zuxpya8q9emxukd7vftaf6h4psr0a07srl5zw74zh84yjqxl5qul"
@@ -15,49 +24,119 @@ OWNER = "terra10s4ujq0m8sfmtgp9v4035g4rhwn22h3ygv5dg0"
 RPC_URL = "http://5.9.66.60:26657"
 RPC_BN = 2554297
 
+UINT128_MAX = str((1 << 128) - 1)
+
+# name and symbol are inserted verbatim, so they must not contain characters that need JSON escaping
+# owner and supply never change, they are filled in here and only name and symbol are left per token
+TOKEN_INSTANTIATE_TEMPLATE = (
+    b'{"name":"%%s","symbol":"%%s","decimals":6,'
+    b'"initial_balances":[{"address":"%s","amount":"%s"}],'
+    b'"mint":{"minter":"%s","cap":"%s"}}'
+) % (OWNER.encode(), UINT128_MAX.encode(), OWNER.encode(), UINT128_MAX.encode())
 
+
+# deprecated, Model.instantiate_ret_addr returns the address directly
 def get_contract_addr_from_instantiate_response(log, code_id):
+    code_id = str(code_id)
     for e in log:
-        events = json.loads(e)["events"]
-        for event in events:
-            if event["type"] == "instantiate":
-                o = {x["key"]: x["value"] for x in event["attributes"]}
-                if o["code_id"] == str(code_id):
-                    return o["_contract_address"]
+        for event in loads(e)["events"]:
+            if event["type"] != "instantiate":
+                continue
+            # scan the attributes once, stop as soon as the code_id mismatches
+            matched, contract_addr = False, None
+            for attribute in event["attributes"]:
+                key = attribute["key"]
+                if key == "code_id":
+                    if attribute["value"] != code_id:
+                        break
+                    matched = True
+                elif key == "_contract_address":
+                    contract_addr = attribute["value"]
+                if matched and contract_addr is not None:
+                    return contract_addr
     raise Exception("not found")
 
 
+# (log entry, attribute) positions of pair_contract_addr and liquidity_token_addr in the last
+# create_pair response. the factory emits its attributes in a fixed order, so later responses
+# are checked there first
+_create_pair_positions = None
+
+
+def _attribute_at(log, entries, pos, key):
+    entry, index = pos
+    if entry >= len(log):
+        return None
+    if entry not in entries:
+        entries[entry] = loads(log[entry])["attributes"]
+    attributes = entries[entry]
+    if index < len(attributes) and attributes[index]["key"] == key:
+        return attributes[index]["value"]
+    return None
+
+
 def get_contract_addr_from_create_pair_response(log):
-    for e in log:
-        attributes = json.loads(e)["attributes"]
-        for attribute in attributes:
-            if attribute["key"] == "pair_contract_addr":
-                pair_contract_addr = attribute["value"]
-            elif attribute["key"] == "liquidity_token_addr":
-                liquidity_token_addr = attribute["value"]
-    return pair_contract_addr, liquidity_token_addr
+    global _create_pair_positions
+    if _create_pair_positions is not None:
+        pair_pos, lp_pos = _create_pair_positions
+        entries = {}
+        pair_contract_addr = _attribute_at(log, entries, pair_pos, "pair_contract_addr")
+        if pair_contract_addr is not None:
+            liquidity_token_addr = _attribute_at(
+                log, entries, lp_pos, "liquidity_token_addr"
+            )
+            if liquidity_token_addr is not None:
+                return pair_contract_addr, liquidity_token_addr
+    # generic scan, the two attributes may come from different log entries
+    pair_contract_addr, liquidity_token_addr = None, None
+    pair_pos, lp_pos = None, None
+    for i, e in enumerate(log):
+        for j, attribute in enumerate(loads(e)["attributes"]):
+            key = attribute["key"]
+            if key == "pair_contract_addr":
+                pair_contract_addr, pair_pos = attribute["value"], (i, j)
+            elif key == "liquidity_token_addr":
+                liquidity_token_addr, lp_pos = attribute["value"], (i, j)
+            else:
+                continue
+            if pair_contract_addr is not None and liquidity_token_addr is not None:
+                _create_pair_positions = (pair_pos, lp_pos)
+                return pair_contract_addr, liquidity_token_addr
+    raise Exception("not found")
 
 
 def get_factory_pair_check_response(log):
-    pair_addr = json.loads(log)["contract_addr"]
-    liquidity_addr = json.loads(log)["liquidity_token"]
+    pair_addr = loads(log)["contract_addr"]
+    liquidity_addr = loads(log)["liquidity_token"]
     return pair_addr, liquidity_addr
 
 
+def escape_dot_label(label):
+    return label.replace("\\", "\\\\").replace('"', '\\"')
+
+
+# writes the call graph as a DOT file and renders it to svg in the background
+# returns the running `dot` process, wait() on it before reading the svg
 def prettify_call_trace(call_graph, call_graph_labels, dir_path):
-    d = Digraph()
-    nodes = set()
-    for src in call_graph:
-        nodes.add(src)
-        for dst in call_graph[src]:
-            nodes.add(dst)
-    for node in nodes:
-        d.node(str(node), call_graph_labels[node])
-        if node in call_graph:
-            for dst in call_graph[node]:
-                d.edge(str(node), str(dst))
-    d.format = "svg"
-    d.render(directory=dir_path)
+    # the union walks all endpoints in C, sorting keeps the output stable between runs
+    nodes = sorted(set().union(call_graph, *call_graph.values()))
+    os.makedirs(dir_path, exist_ok=True)
+    dot_path = os.path.join(dir_path, "callgraph.gv")
+    with open(dot_path, "w") as f:
+        f.write("digraph {\n")
+        f.writelines(
+            '\t{} [label="{}"]\n'.format(
+                node, escape_dot_label(call_graph_labels[node])
+            )
+            for node in nodes
+        )
+        f.writelines(
+            "\t{} -> {}\n".format(src, dst)
+            for src, dsts in call_graph.items()
+            for dst in dsts
+        )
+        f.write("}\n")
+    return subprocess.Popen(["dot", "-Tsvg", "-o", dot_path + ".svg", dot_path])
 
 
 class Test:
@@ -66,7 +145,7 @@ class Test:
         self.m.cheat_message_sender(OWNER)
 
     def add_pair(self, token1_addr, token2_addr):
-        execute_msg = json.dumps(
+        execute_msg = dumps(
             {
                 "create_pair": {
                     "asset_infos": [
@@ -75,22 +154,19 @@ class Test:
                     ]
                 }
             }
-        ).encode()
+        )
         res = self.m.execute(TERRASWAP_FACTORY_ADDR, execute_msg, [])
         return res
 
     def create_token(self, token_name, token_symbol):
-        instantiate_msg = json.dumps(
-            {
-                "name": token_name,
-                "symbol": token_symbol,
-                "decimals": 6,
-                "initial_balances": [{"address": OWNER, "amount": str(2**128 - 1)}],
-                "mint": {"minter": OWNER, "cap": str(2**128 - 1)},
-            }
-        ).encode()
-        res = self.m.instantiate(TOKEN_CODE_ID, instantiate_msg, [])
-        return get_contract_addr_from_instantiate_response(res.get_log(), TOKEN_CODE_ID)
+        instantiate_msg = TOKEN_INSTANTIATE_TEMPLATE % (
+            token_name.encode(),
+            token_symbol.encode(),
+        )
+        token_addr, res = self.m.instantiate_ret_addr(TOKEN_CODE_ID, instantiate_msg, [])
+        if token_addr is None:
+            raise Exception(res.get_err_msg())
+        return token_addr
 
 
 def testFactoryAddPairs():
@@ -106,7 +182,8 @@ def testFactoryAddPairs():
     print("[+] New pair created: {}".format(pair_addr))
 
     call_graph, call_graph_labels = res.get_call_trace()
-    prettify_call_trace(call_graph, call_graph_labels, "callgraphs")
+    render = prettify_call_trace(call_graph, call_graph_labels, "callgraphs")
+    render.wait()
 
 
 if __name__ == "__main__":
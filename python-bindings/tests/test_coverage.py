@@ -1,15 +1,46 @@
 from cwsimpy import Model
-import json
 import base64
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from orjson import dumps, loads
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
+    loads = json.loads
+
+EMPTY_MSG = b"{}"
+# serialized once at import time, not on every swap
+SWAP_MSG = dumps(
+    {
+        "swap": {
+            "offer_asset": {
+                "info": {"native_token": {"denom": "umlg"}},
+                "amount": "100",
+            },
+            "belief_price": None,
+            "max_spread": None,
+            "to": None,
+        }
+    }
+)
 
 
 def to_binary(msg):
-    return base64.b64encode(json.dumps(msg).encode()).decode("ascii")
+    return base64.b64encode(dumps(msg))
 
 
-def decode_vec(v):
-    v = bytearray(v)
-    return v.decode("utf-8")
+# maps the wasm file read-only and asks the kernel to start paging it in
+def map_code(path):
+    with open(path, "rb") as f:
+        code = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_WILLNEED"):
+        code.madvise(mmap.MADV_WILLNEED)
+    return code
 
 
 def test_swap():
@@ -18,30 +49,28 @@ def test_swap():
     PAIR_ADDR = "wasm15le5evw4regnwf9lrjnpakr2075fcyp4n4yzpelvqcuevzkw2lss46hslz"
 
     m = Model(RPC_URL, RPC_BN, "wasm")
-    swap_msg = json.dumps(
-        {
-            "swap": {
-                "offer_asset": {
-                    "info": {"native_token": {"denom": "umlg"}},
-                    "amount": "100",
-                },
-                "belief_price": None,
-                "max_spread": None,
-                "to": None,
-            }
-        }
-    ).encode()
-    logs = m.execute(PAIR_ADDR, swap_msg, [("umlg", 100)])
+    logs = m.execute(PAIR_ADDR, SWAP_MSG, [("umlg", 100)])
 
 
+# deprecated, Model.instantiate_ret_addr returns the address directly
 def get_contract_addr_from_instantiate_response(log, code_id):
+    code_id = str(code_id)
     for e in log:
-        events = json.loads(e)["events"]
-        for event in events:
-            if event["type"] == "instantiate":
-                o = {x["key"]: x["value"] for x in event["attributes"]}
-                if o["code_id"] == str(code_id):
-                    return o["_contract_address"]
+        for event in loads(e)["events"]:
+            if event["type"] != "instantiate":
+                continue
+            # scan the attributes once, stop as soon as the code_id mismatches
+            matched, contract_addr = False, None
+            for attribute in event["attributes"]:
+                key = attribute["key"]
+                if key == "code_id":
+                    if attribute["value"] != code_id:
+                        break
+                    matched = True
+                elif key == "_contract_address":
+                    contract_addr = attribute["value"]
+                if matched and contract_addr is not None:
+                    return contract_addr
     raise Exception("not found")
 
 
@@ -55,19 +84,20 @@ if __name__ == "__main__":
     RPC_URL = "https://rpc.malaga-420.cosmwasm.com:443"
     RPC_BN = 2326474
 
-    m = Model(RPC_URL, RPC_BN, "wasm")
+    CODE_PATH = "/home/procfs/cosmwasm-simulate/target/wasm32-unknown-unknown/release/test_contract_cov.wasm"
+    # the Model constructor releases the GIL, map the code while it syncs over RPC
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        code_fut = ex.submit(map_code, CODE_PATH)
+        m = Model(RPC_URL, RPC_BN, "wasm")
     m.cheat_message_sender(MY_ADDRESS)
     m.enable_code_coverage()
+    with code_fut.result() as code:
+        m.add_custom_code(1337, code)
 
-    CODE_PATH = "/home/procfs/cosmwasm-simulate/target/wasm32-unknown-unknown/release/test_contract_cov.wasm"
-    with open(CODE_PATH, "rb") as f:
-        code = f.read()
-    m.add_custom_code(1337, code)
-
-    imsg = json.dumps({}).encode()
-    res = m.instantiate(1337, imsg, [])
-    contract_addr = get_contract_addr_from_instantiate_response(res.get_log(), 1337)
+    imsg = EMPTY_MSG
+    contract_addr, res = m.instantiate_ret_addr(1337, imsg, [])
+    assert contract_addr is not None, res.get_err_msg()
 
-    covs = res.get_code_coverage_for_address(contract_addr)
+    covs = m.get_code_coverage()[contract_addr]
     with open("cov.profraw", "wb") as f:
-        f.write(bytearray(covs[0]))
+        f.write(covs[0])
@@ -1,15 +1,40 @@
 from cwsimpy import Model
-import json
 
+try:
+    from orjson import dumps, loads
+except ImportError:
+    import json
 
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
+    loads = json.loads
+
+BALANCE_TEMPLATE = b'{"balance":{"address":"%s"}}'
+CONFIG_MSG = b'{"config":{}}'
+INITIAL_SUPPLY = 10**20
+INITIAL_SUPPLY_STR = str(INITIAL_SUPPLY)
+
+
+# deprecated, Model.instantiate_ret_addr returns the address directly
 def get_contract_addr_from_instantiate_response(log, code_id):
+    code_id = str(code_id)
     for e in log:
-        events = json.loads(e)["events"]
-        for event in events:
-            if event["type"] == "instantiate":
-                o = {x["key"]: x["value"] for x in event["attributes"]}
-                if o["code_id"] == str(code_id):
-                    return o["_contract_address"]
+        for event in loads(e)["events"]:
+            if event["type"] != "instantiate":
+                continue
+            # scan the attributes once, stop as soon as the code_id mismatches
+            matched, contract_addr = False, None
+            for attribute in event["attributes"]:
+                key = attribute["key"]
+                if key == "code_id":
+                    if attribute["value"] != code_id:
+                        break
+                    matched = True
+                elif key == "_contract_address":
+                    contract_addr = attribute["value"]
+                if matched and contract_addr is not None:
+                    return contract_addr
     raise Exception("not found")
 
 
@@ -29,62 +54,49 @@ if __name__ == "__main__":
     PAIR_CODE_ID = 2387
 
     m.cheat_message_sender(addr2)
-    instantiate_msg = json.dumps(
+    instantiate_msg = dumps(
         {
             "name": "DreamToken",
             "symbol": "DTK",
             "decimals": 6,
-            "initial_balances": [{"address": addr2, "amount": str(10**20)}],
-            "mint": {"minter": addr2, "cap": str(10**20)},
+            "initial_balances": [{"address": addr2, "amount": INITIAL_SUPPLY_STR}],
+            "mint": {"minter": addr2, "cap": INITIAL_SUPPLY_STR},
         }
-    ).encode()
+    )
 
-    res = m.instantiate(
+    TOKEN_ADDR, res = m.instantiate_ret_addr(
         TOKEN_CODE_ID,
         instantiate_msg,
         [],
     )
-    TOKEN_ADDR = get_contract_addr_from_instantiate_response(
-        res.get_log(), TOKEN_CODE_ID
-    )
+    assert TOKEN_ADDR is not None, res.get_err_msg()
 
-    query_msg = json.dumps({"balance": {"address": addr2}}).encode()
+    query_msg = BALANCE_TEMPLATE % addr2.encode()
 
-    owner_balance = int(
-        json.loads(bytearray(m.wasm_query(TOKEN_ADDR, query_msg)).decode("ascii"))[
-            "balance"
-        ]
-    )
-    assert owner_balance == 10**20
+    owner_balance = int(m.wasm_query_typed(TOKEN_ADDR, query_msg, "/balance"))
+    assert owner_balance == INITIAL_SUPPLY
 
-    instantiate_msg = json.dumps(
+    instantiate_msg = dumps(
         {
             "pair_code_id": PAIR_CODE_ID,
             "token_code_id": TOKEN_CODE_ID,
         }
-    ).encode()
-    res = m.instantiate(
+    )
+    FACTORY_ADDR, res = m.instantiate_ret_addr(
         FACTORY_CODE_ID,
         instantiate_msg,
         [],
     )
-    FACTORY_ADDR = get_contract_addr_from_instantiate_response(
-        res.get_log(), FACTORY_CODE_ID
-    )
+    assert FACTORY_ADDR is not None, res.get_err_msg()
 
-    query_msg = json.dumps({"config": {}}).encode()
-    factory_owner = json.loads(
-        bytearray(m.wasm_query(FACTORY_ADDR, query_msg)).decode("ascii")
-    )["owner"]
+    query_msg = CONFIG_MSG
+    factory_owner = m.wasm_query_typed(FACTORY_ADDR, query_msg, "/owner")
     assert factory_owner == addr2
 
-    execute_msg = json.dumps(
+    decimals_msg = dumps(
         {"add_native_token_decimals": {"denom": "umlg", "decimals": 6}}
-    ).encode()
-    res = m.execute(FACTORY_ADDR, execute_msg, [("umlg", 1)])
-    assert res.get_err_msg() == ""
-
-    execute_msg = json.dumps(
+    )
+    create_pair_msg = dumps(
         {
             "create_pair": {
                 "asset_infos": [
@@ -93,7 +105,7 @@ if __name__ == "__main__":
                 ]
             }
         }
-    ).encode()
+    )
     print(FACTORY_ADDR)
     print(TOKEN_ADDR)
 
@@ -101,6 +113,9 @@ if __name__ == "__main__":
     with open(FACTORY_CODE_PATH, "rb") as f:
         FACTORY_CODE = f.read()
     # m.cheat_code(FACTORY_ADDR, FACTORY_CODE)
-    res = m.execute(FACTORY_ADDR, execute_msg, [])
+    # create_pair needs the decimals registered, so it must only run once that succeeded
+    res = m.execute(FACTORY_ADDR, decimals_msg, [("umlg", 1)])
+    assert res.get_err_msg() == ""
+    res = m.execute(FACTORY_ADDR, create_pair_msg, [])
     print(res.get_log())
     print(res.get_err_msg())
@@ -1,5 +1,13 @@
 from cwsimpy import Model
-import json
+
+try:
+    from orjson import dumps
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
 
 if __name__ == "__main__":
     RPC_URL = "https://rpc.malaga-420.cosmwasm.com:443"
@@ -13,7 +21,7 @@ if __name__ == "__main__":
     m = Model(RPC_URL, RPC_BN, "wasm")
     m.cheat_bank_balance(VAULET_ADDRESS, ("umlg", 10**9))
 
-    flashloan_msg = json.dumps(
+    flashloan_msg = dumps(
         {
             "flash_loan": {
                 "assets": [
@@ -31,7 +39,7 @@ if __name__ == "__main__":
                 ],
             }
         }
-    ).encode()
+    )
     funds = [("umlg", 33)]
     logs = m.execute(VAULT_ROUTER_ADDRESS, flashloan_msg, funds)
     for x in logs.get_log():
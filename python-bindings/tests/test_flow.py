@@ -1,15 +1,20 @@
 from cwsimpy import Model
-import json
 import base64
 
+try:
+    from orjson import dumps
+except ImportError:
+    import json
 
-def to_binary(msg):
-    return base64.b64encode(json.dumps(msg).encode()).decode("ascii")
+    def dumps(obj):
+        return json.dumps(obj).encode()
+
+
+FLOW_MSG = b'{"flow":{}}'
 
 
-def decode_vec(v):
-    v = bytearray(v)
-    return v.decode("utf-8")
+def to_binary(msg):
+    return base64.b64encode(dumps(msg))
 
 
 if __name__ == "__main__":
@@ -22,18 +27,11 @@ if __name__ == "__main__":
     RPC_URL = "https://rpc.malaga-420.cosmwasm.com:443"
     RPC_BN = 2326474
 
+    CODE_PATH = "/home/procfs/cosmwasm-simulate/target/wasm32-unknown-unknown/release/callee.wasm"
     m = Model(RPC_URL, RPC_BN, "wasm")
     m.cheat_message_sender(MY_ADDRESS)
+    m.cheat_code_from_path(PAIR_ADDR, CODE_PATH)
 
-    CODE_PATH = "/home/procfs/cosmwasm-simulate/target/wasm32-unknown-unknown/release/callee.wasm"
-    with open(CODE_PATH, "rb") as f:
-        code = f.read()
-    msg = json.dumps(
-        {
-            "flow": {}
-        }
-    ).encode()
-    m.cheat_code(PAIR_ADDR, code)
-    logs = m.execute(PAIR_ADDR, msg, [])
+    logs = m.execute(PAIR_ADDR, FLOW_MSG, [])
     print(logs.get_log())
     print(logs.get_err_msg())
\ No newline at end of file
@@ -1,15 +1,36 @@
 from cwsimpy import Model
-import json
 import base64
 
+try:
+    from orjson import dumps
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj).encode()
 
-def to_binary(msg):
-    return base64.b64encode(json.dumps(msg).encode()).decode("ascii")
 
+BALANCE_TEMPLATE = b'{"balance":{"address":"%s"}}'
+SEND_TEMPLATE = b'{"send":{"contract":"%s","amount":"%s","msg":"%s"}}'
+# serialized once at import time, not on every swap
+SWAP_MSG = dumps(
+    {
+        "swap": {
+            "offer_asset": {
+                "info": {"native_token": {"denom": "umlg"}},
+                "amount": "100",
+            },
+            "belief_price": None,
+            "max_spread": None,
+            "to": None,
+        }
+    }
+)
 
-def decode_vec(v):
-    v = bytearray(v)
-    return v.decode("utf-8")
+
+# base64 is plain ascii, so the encoded bytes can be spliced into a template as they are
+def to_binary(msg):
+    return base64.b64encode(dumps(msg))
 
 
 if __name__ == "__main__":
@@ -17,6 +38,9 @@ if __name__ == "__main__":
     TOKEN_ADDR = "wasm124v54ngky9wxhx87t252x4xfgujmdsu7uhjdugtkkqt39nld0e6st7e64h"
     PAIR_ADDR = "wasm15le5evw4regnwf9lrjnpakr2075fcyp4n4yzpelvqcuevzkw2lss46hslz"
     LPTOKEN_ADDR = "wasm147ntaasx8mcx6a8jk7cvpyvus8r80garfnue4qrzrl0whk9ftntqpld03t"
+    # encoded once, the bindings accept bytes addresses as well
+    TOKEN_ADDR_B = TOKEN_ADDR.encode()
+    PAIR_ADDR_B = PAIR_ADDR.encode()
     MY_ADDRESS = "wasm1zcnn5gh37jxg9c6dp4jcjc7995ae0s5f5hj0lj"
 
     RPC_URL = "https://rpc.malaga-420.cosmwasm.com:443"
@@ -25,59 +49,36 @@ if __name__ == "__main__":
     m = Model(RPC_URL, RPC_BN, "wasm")
     m.cheat_message_sender(MY_ADDRESS)
 
-    balance_query_msg = json.dumps({"balance": {"address": MY_ADDRESS}}).encode()
-    swap_msg = json.dumps(
-        {
-            "swap": {
-                "offer_asset": {
-                    "info": {"native_token": {"denom": "umlg"}},
-                    "amount": "100",
-                },
-                "belief_price": None,
-                "max_spread": None,
-                "to": None,
-            }
-        }
-    ).encode()
-    bal1 = int(
-        json.loads(decode_vec(m.wasm_query(TOKEN_ADDR, balance_query_msg)))["balance"]
-    )
-    logs = m.execute(PAIR_ADDR, swap_msg, [("umlg", 100)])
-    bal2 = int(
-        json.loads(decode_vec(m.wasm_query(TOKEN_ADDR, balance_query_msg)))["balance"]
-    )
+    balance_query_msg = BALANCE_TEMPLATE % MY_ADDRESS.encode()
+    bal1 = int(m.wasm_query_typed(TOKEN_ADDR_B, balance_query_msg, "/balance"))
+    logs = m.execute(PAIR_ADDR_B, SWAP_MSG, [("umlg", 100)])
+    bal2 = int(m.wasm_query_typed(TOKEN_ADDR_B, balance_query_msg, "/balance"))
     print("got tokens: {}".format(bal2 - bal1))
 
-    swap_msg = json.dumps(
-        {
-            "send": {
-                "contract": PAIR_ADDR,
-                "amount": "10",
-                "msg": to_binary(
-                    {
-                        "swap": {
-                            "belief_price": None,
-                            "max_spread": None,
-                            "to": MY_ADDRESS,
-                        }
-                    }
-                ),
+    swap_msg = SEND_TEMPLATE % (
+        PAIR_ADDR_B,
+        b"10",
+        to_binary(
+            {
+                "swap": {
+                    "belief_price": None,
+                    "max_spread": None,
+                    "to": MY_ADDRESS,
+                }
             }
-        }
-    ).encode()
-    logs = m.execute(TOKEN_ADDR, swap_msg, [])
-    bal3 = int(
-        json.loads(decode_vec(m.wasm_query(TOKEN_ADDR, balance_query_msg)))["balance"]
+        ),
     )
+    logs = m.execute(TOKEN_ADDR_B, swap_msg, [])
+    bal3 = int(m.wasm_query_typed(TOKEN_ADDR_B, balance_query_msg, "/balance"))
     print("spent tokens: {}".format(bal2 - bal3))
 
-    msg = json.dumps(
+    msg = dumps(
         {
             "balance": {
                 "address": MY_ADDRESS,
                 "denom": "umlg",
             }
         }
-    ).encode()
-    bal_umlg = bytearray(m.bank_query(msg)).decode()
+    )
+    bal_umlg = m.bank_query(msg).decode()
     print(bal_umlg)